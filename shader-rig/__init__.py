@@ -8,8 +8,9 @@ bl_info = {
     "category": "NPR",
 }
 
+import logging
+
 import bpy
-from mathutils import Vector
 
 from . import (
     addremove_helpers,
@@ -20,16 +21,23 @@ from . import (
     setup_helpers,
     update_helpers,
     visual_helpers,
-    node_helpers
 )
 
-bpy.app.driver_namespace["hansens_float_packer"] = hansens_float_packer
-# this has to be globally assigned to work consistently
-# actually, no, it just doesn't work consistently at all
-# seems like this only works immediately after you install
-# an addon. Definitely a bug
+_log = logging.getLogger("shading_rig")
 
 _previous_light_rotations = {}
+# Cache-miss value for _previous_light_rotations: any arithmetic with NaN
+# yields NaN, and NaN < x is always False, so a miss never counts as "unchanged"
+_NO_PREVIOUS_ROTATION = (float("nan"),) * 3
+_last_snapshot = ()
+
+# Panel-side cache of "is this object too big for shading rig effects",
+# keyed by object pointer. Cleared whenever the depsgraph reports an
+# object update, so draw() doesn't recompute dimensions on every redraw.
+_object_too_large = {}
+
+# Owner token for our msgbus subscriptions, so they can be cleared as a group
+_msgbus_owner = object()
 
 from bpy.props import (
     BoolProperty,
@@ -38,6 +46,7 @@ from bpy.props import (
     FloatProperty,
     FloatVectorProperty,
     IntProperty,
+    IntVectorProperty,
     PointerProperty,
     StringProperty,
 )
@@ -60,6 +69,7 @@ class SR_CorrelationItem(PropertyGroup):
         unit="ROTATION",
         size=3,
         description="Stored rotation of the light object",
+        update=math_helpers.clearPackedCorrelations,
     )
 
     empty_position: FloatVectorProperty(
@@ -68,6 +78,7 @@ class SR_CorrelationItem(PropertyGroup):
         unit="LENGTH",
         size=3,
         description="Stored position of the empty object",
+        update=math_helpers.clearPackedCorrelations,
     )
 
     empty_rotation: FloatVectorProperty(
@@ -76,6 +87,7 @@ class SR_CorrelationItem(PropertyGroup):
         unit="ROTATION",
         size=3,
         description="Stored rotation of the empty object",
+        update=math_helpers.clearPackedCorrelations,
     )
 
     empty_scale: FloatVectorProperty(
@@ -84,35 +96,39 @@ class SR_CorrelationItem(PropertyGroup):
         size=3,
         default=(1.0, 1.0, 1.0),
         description="Stored scale of the empty object",
+        update=math_helpers.clearPackedCorrelations,
     )
 
     # Fergalicious definition?
 
 
-def get_blend_mode_items(self, _context):
-    """Dynamically generate blend mode items for the EnumProperty."""
-    # This list of identifiers MUST match the order in setup_helpers.create_mode_mix_nodes
-    blend_mode_identifiers = ["LIGHTEN", "SUBTRACT", "MULTIPLY", "DARKEN", "ADD"]
+# This list of identifiers MUST match the order in node_helpers.create_mode_mix_nodes.
+# Kept as a module-level tuple rather than an items callback: Blender calls
+# dynamic items functions constantly while the panel is open, and static
+# items need a live Python reference anyway.
+_BLEND_MODE_ITEMS = (
+    ("LIGHTEN", "Lighten", "Set blend mode to Lighten", "OUTLINER_OB_LIGHT", 0),
+    ("SUBTRACT", "Subtract", "Set blend mode to Subtract", "REMOVE", 1),
+    ("MULTIPLY", "Multiply", "Set blend mode to Multiply", "PANEL_CLOSE", 2),
+    ("DARKEN", "Darken", "Set blend mode to Darken", "LIGHT", 3),
+    ("ADD", "Add", "Set blend mode to Add", "ADD", 4),
+)
+
 
-    icon_map = {
-        "LIGHTEN": "OUTLINER_OB_LIGHT",
-        "SUBTRACT": "REMOVE",
-        "MULTIPLY": "PANEL_CLOSE",
-        "DARKEN": "LIGHT",
-        "ADD": "ADD",
-    }
+# Object picker polls; Blender calls these once per candidate object
+def _poll_empty(self, obj):
+    return obj.type == "EMPTY"
 
-    items = []
-    for i, identifier in enumerate(blend_mode_identifiers):
-        # Format for UI display (e.g., "LIGHTEN" -> "Lighten")
-        name = identifier.title()
-        description = f"Set blend mode to {name}"
-        icon = icon_map.get(identifier, "NONE")
 
-        # The full tuple: (identifier, name, description, icon, number)
-        items.append((identifier, name, description, icon, i))
+def _poll_light(self, obj):
+    return obj.type == "LIGHT"
 
-    return items
+
+_PARENT_TYPES = frozenset(("MESH", "CURVE", "EMPTY"))
+
+
+def _poll_parent(self, obj):
+    return obj.type in _PARENT_TYPES
 
 
 def sr_rig_item_name_update(self, context):
@@ -120,6 +136,16 @@ def sr_rig_item_name_update(self, context):
     if self.empty_object and self.name != self.empty_object.name:
         if self.name:
             self.empty_object.name = self.name
+            # msgbus doesn't notify on renames made from Python
+            sync_renamed_empties(context.scene)
+
+
+def sr_rig_item_empty_update(self, context):
+    """When the rig's Empty is reassigned, carry the shader node names over to it."""
+    update_helpers.mark_active_rigs_dirty()
+    # Reads the old node names before deriving the new ones, so
+    # don't touch them here first
+    sync_renamed_empties(context.scene)
 
 
 class SR_RigItem(PropertyGroup):
@@ -135,21 +161,23 @@ class SR_RigItem(PropertyGroup):
         name="Empty Object",
         description="The Empty object that acts as a controller or origin point",
         type=bpy.types.Object,
-        poll=lambda self, obj: obj.type == "EMPTY",
+        poll=_poll_empty,
+        update=sr_rig_item_empty_update,
     )
 
     light_object: PointerProperty(
         name="Light Object",
         description="The Light object that acts as a light source or projection point",
         type=bpy.types.Object,
-        poll=lambda self, obj: obj.type == "LIGHT",
+        poll=_poll_light,
+        update=update_helpers.mark_active_rigs_dirty,
     )
 
     parent_object: PointerProperty(
         name="Parent Object",
         description="The object to which the Empty will be parented",
         type=bpy.types.Object,
-        poll=lambda self, obj: obj.type in {"MESH", "CURVE", "EMPTY"},
+        poll=_poll_parent,
         update=update_helpers.update_parent_object,
     )
 
@@ -223,8 +251,8 @@ class SR_RigItem(PropertyGroup):
     mode: EnumProperty(
         name="Mode",
         description="Mode of the shading rig effect",
-        items=get_blend_mode_items,
-        default=0,
+        items=_BLEND_MODE_ITEMS,
+        default="LIGHTEN",
         update=update_helpers.property_update_sync,
     )
 
@@ -244,6 +272,13 @@ class SR_RigItem(PropertyGroup):
         update=update_helpers.property_update_sync,
     )
 
+    packed: IntVectorProperty(
+        name="Packed Values",
+        description="Internal: Output of the float packer for this effect, set by its drivers and read by the per-object drivers",
+        size=3,
+        default=(0, 0, 0),
+    )
+
     show_active_settings: BoolProperty(
         name="Show Active Rig Settings",
         description="Toggle visibility of active rig settings",
@@ -260,6 +295,23 @@ class SR_RigItem(PropertyGroup):
         default="",
     )
 
+    shading_node_name: StringProperty(
+        name="Shading Node Name",
+        description="Internal: Name of this effect's ShadingRigEffect node, derived from the empty name.",
+        default="",
+    )
+
+    mix_node_name: StringProperty(
+        name="Mix Node Name",
+        description="Internal: Name of this effect's MixRGB node, derived from the empty name.",
+        default="",
+    )
+
+
+# draw_item runs for every visible row on every redraw,
+# so build the layout type set once instead of per call
+_DEFAULT_COMPACT = frozenset(("DEFAULT", "COMPACT"))
+
 
 class SR_UL_RigList(UIList):
     """UIList for displaying the list of shading rigs."""
@@ -267,10 +319,10 @@ class SR_UL_RigList(UIList):
     def draw_item(
         self, context, layout, data, item, icon, active_data, active_propname, index
     ):
-        if self.layout_type in {"DEFAULT", "COMPACT"}:
+        if self.layout_type in _DEFAULT_COMPACT:
             layout.prop(item, "name", text="", emboss=False, icon="EMPTY_DATA")
 
-        elif self.layout_type in {"GRID"}:
+        elif self.layout_type == "GRID":
             layout.alignment = "CENTER"
             layout.label(text="", icon="OBJECT_DATA")
 
@@ -282,11 +334,11 @@ class SR_UL_CorrelationList(UIList):
         self, context, layout, data, item, icon, active_data, active_propname, index
     ):
 
-        if self.layout_type in {"DEFAULT", "COMPACT"}:
+        if self.layout_type in _DEFAULT_COMPACT:
 
             layout.prop(item, "name", text="", emboss=False, icon="DOT")
 
-        elif self.layout_type in {"GRID"}:
+        elif self.layout_type == "GRID":
             layout.alignment = "CENTER"
             layout.label(text="", icon="DOT")
 
@@ -455,11 +507,11 @@ class SR_PT_ShadingRigPanel(Panel):
                         and active_item.material
                         and active_item.material.node_tree
                     ):
-                        if (
-                            active_object.dimensions.x > 2.0
-                            or active_object.dimensions.y > 2.0
-                            or active_object.dimensions.z > 2.0
-                        ):
+                        too_large = _object_too_large.get(active_object.as_pointer())
+                        if too_large is None:
+                            too_large = max(active_object.dimensions) > 2.0
+                            _object_too_large[active_object.as_pointer()] = too_large
+                        if too_large:
                             col.label(
                                 text="Active object is too large for shading rig effects to work properly.",
                             )
@@ -519,20 +571,61 @@ class SR_PT_ShadingRigPanel(Panel):
                 col.prop(active_corr, "empty_rotation", text="Empty Rotation")
 
 
+def register_driver_namespace():
+    """Expose the packer to driver expressions as packing_algorithm(...)."""
+    bpy.app.driver_namespace["packing_algorithm"] = hansens_float_packer.packing_algorithm
+
+
+@bpy.app.handlers.persistent
+def driver_namespace_load_handler(dummy):
+    # Blender clears driver_namespace on every file load, so put the
+    # packer back before any drivers calling it are evaluated
+    register_driver_namespace()
+
+
 @bpy.app.handlers.persistent
 def load_handler(dummy):
+    update_helpers.mark_active_rigs_dirty()
     if bpy.data.objects.get("ShadingRigSceneProperties"):
-        json_helpers.sync_json_to_scene(bpy.context.scene)
+        scene = bpy.context.scene
+        json_helpers.sync_json_to_scene(scene)
         # As long as the addon is installed,
         # this should allow appending between files
 
+        # Rigs restored from JSON may not have packing drivers on
+        # this scene yet; channels that already have one are skipped
+        for rig_index in range(len(scene.shading_rig_list)):
+            update_helpers.add_packing_drivers(scene, rig_index)
+
 
 @bpy.app.handlers.persistent
-def update_shading_rig_handler(scene, depsgraph):
+def save_handler(dummy):
+    # Don't let a debounced JSON sync miss the save
+    json_helpers.flush_scheduled_sync()
+
+
+@bpy.app.handlers.persistent
+def undo_handler(dummy):
+    """Undo/redo can change rigs and correlations without any update callbacks."""
+    update_helpers.mark_active_rigs_dirty()
+    math_helpers.clearPackedCorrelations()
+    # The debounced sync lands after the operator's undo step is stored, so
+    # each step holds JSON one edit behind the rig list it restores
+    json_helpers.schedule_sync(bpy.context.scene)
+
+
+@bpy.app.handlers.persistent
+def clear_rotation_cache_handler(dummy):
+    """Drop per-light caches; their pointer keys are invalid after a file load."""
+    global _last_snapshot
+    _previous_light_rotations.clear()
+    _object_too_large.clear()
+    _last_snapshot = ()
+
+
+def sync_renamed_empties(scene):
     """
-    Handles automatic updates for the Shading Rig system.
-    1. Detects renames of Empty objects and syncs shader node names.
-    2. Interpolates Empty transform based on Light rotation.
+    Detects renames of Empty objects and syncs shader node names.
     """
     # realistically, though, something is almost certain
     # to break if you rename an effect...
@@ -540,79 +633,163 @@ def update_shading_rig_handler(scene, depsgraph):
     for rig_item in scene.shading_rig_list:
         empty_obj = rig_item.empty_object
         if not empty_obj:
-            print(
-                f"Shading Rig Debug: Skipping rig '{rig_item.name}' - no Empty object assigned."
-            )
             continue
 
         current_empty_name = empty_obj.name
-        if rig_item.last_empty_name and rig_item.last_empty_name != current_empty_name:
-            old_empty_name = rig_item.last_empty_name
+        if rig_item.last_empty_name == current_empty_name:
+            continue
 
-            if rig_item.material and rig_item.material.node_tree:
-                node_tree = rig_item.material.node_tree
+        old_empty_name = rig_item.last_empty_name
+        old_shading_node_name = rig_item.shading_node_name
+        old_mix_node_name = rig_item.mix_node_name
+        if old_empty_name and not old_shading_node_name:
+            # Rig from a file saved before the node names were stored
+            old_shading_node_name = f"ShadingRigEffect_{old_empty_name}"
+            old_mix_node_name = f"MixRGB_{old_empty_name}"
+
+        update_helpers.update_node_names(rig_item)
+
+        if old_empty_name and rig_item.material and rig_item.material.node_tree:
+            node_tree = rig_item.material.node_tree
+
+            # nodes.get() is a linear search by name anyway, so
+            # find both nodes in a single pass instead of two
+            renames = {
+                old_shading_node_name: rig_item.shading_node_name,
+                old_mix_node_name: rig_item.mix_node_name,
+            }
+            for node in node_tree.nodes:
+                new_node_name = renames.pop(node.name, None)
+                if new_node_name:
+                    node.name = new_node_name
+                    node.label = new_node_name
+                    if not renames:
+                        break
+
+        rig_item.last_empty_name = current_empty_name
+
+
+def _on_object_rename():
+    sync_renamed_empties(bpy.context.scene)
+
+
+def subscribe_to_renames():
+    """(Re)subscribe to Object.name changes; file loads drop msgbus subscriptions."""
+    bpy.msgbus.clear_by_owner(_msgbus_owner)
+    bpy.msgbus.subscribe_rna(
+        key=(bpy.types.Object, "name"),
+        owner=_msgbus_owner,
+        args=(),
+        notify=_on_object_rename,
+    )
 
-                old_shading_node_name = f"ShadingRigEffect_{old_empty_name}"
-                new_shading_node_name = f"ShadingRigEffect_{current_empty_name}"
-                shading_node = node_tree.nodes.get(old_shading_node_name)
-                if shading_node:
-                    shading_node.name = new_shading_node_name
-                    shading_node.label = new_shading_node_name
 
-                old_mix_node_name = f"MixRGB_{old_empty_name}"
-                new_mix_node_name = f"MixRGB_{current_empty_name}"
-                mix_node = node_tree.nodes.get(old_mix_node_name)
-                if mix_node:
-                    mix_node.name = new_mix_node_name
-                    mix_node.label = new_mix_node_name
+@bpy.app.handlers.persistent
+def msgbus_load_handler(dummy):
+    subscribe_to_renames()
+
+
+def _light_snapshot(active_rigs):
+    """Cheap, comparable summary of everything the handler reacts to."""
+    return tuple(
+        (
+            r.light_object.name_full,
+            tuple(r.light_object.rotation_euler),
+        )
+        for r in active_rigs
+    )
 
-        if rig_item.last_empty_name != current_empty_name:
-            rig_item.last_empty_name = current_empty_name
 
+@bpy.app.handlers.persistent
+def update_shading_rig_handler(scene, depsgraph):
+    """
+    Handles automatic updates for the Shading Rig system.
+    Interpolates Empty transform based on Light rotation.
+    Renames are handled separately by the Object.name msgbus subscription.
+    """
+    if depsgraph.id_type_updated("OBJECT"):
+        _object_too_large.clear()
+
+    # Keep out of the way of renders, where writing to RNA from a handler can raise
+    if bpy.app.is_job_running("RENDER"):
+        return
+
+    _update_shading_rigs(scene, depsgraph)
+
+
+def _update_shading_rigs(scene, depsgraph):
+    global _last_snapshot
+
+    # This fires on every depsgraph update (selection, edits to unrelated
+    # objects...), so bail out before doing any real work unless a tracked
+    # light has actually rotated.
+    rig_list = scene.shading_rig_list
+    active_rigs = [rig_list[i] for i in update_helpers.get_active_rig_indices(rig_list)]
+
+    try:
+        snapshot = _light_snapshot(active_rigs)
+    except AttributeError:
+        # A cached rig's Empty or Light was deleted out from under us
+        update_helpers.mark_active_rigs_dirty()
+        active_rigs = [
+            rig_list[i] for i in update_helpers.get_active_rig_indices(rig_list)
+        ]
+        snapshot = _light_snapshot(active_rigs)
+    if snapshot == _last_snapshot:
+        return
+
+    for rig_item in active_rigs:
+        empty_obj = rig_item.empty_object
         light_obj = rig_item.light_object
-        correlations = rig_item.correlations
-        if not light_obj:
-            print(
-                f"Shading Rig Debug: Skipping rig '{rig_item.name}' - no Light object assigned."
-            )
-            continue
-        if len(correlations) == 0:
-            print(
-                f"Shading Rig Debug: Skipping rig '{rig_item.name}' - no correlations found."
-            )
+        # The snapshot only covers the lights, so an Empty cleared or all
+        # correlations removed since the cache was built wouldn't show there
+        if not empty_obj or len(rig_item.correlations) == 0:
+            update_helpers.mark_active_rigs_dirty()
             continue
 
         eval_light_obj = light_obj.evaluated_get(depsgraph)
         if not eval_light_obj:
-            print(
-                f"Shading Rig Debug: Skipping rig '{rig_item.name}' - could not get evaluated light object from depsgraph."
-            )
+            if _log.isEnabledFor(logging.DEBUG):
+                _log.debug(
+                    f"Skipping rig '{rig_item.name}' - could not get evaluated light object from depsgraph."
+                )
             continue
 
         current_light_rotation = eval_light_obj.rotation_euler
-        light_obj_key = light_obj.name_full
-
-        prev_rot = _previous_light_rotations.get(light_obj_key)
-        if prev_rot:
-            v_prev = Vector(prev_rot)
-            v_curr = Vector(current_light_rotation)
-            if (v_prev - v_curr).length < 1e-5:
-                continue
-
-        weighted_pos, weighted_scale, weighted_rotation = (
-            math_helpers.calculateWeightedEmptyPosition(
-                correlations, current_light_rotation
-            )
+        # One bulk read of all three components instead of crossing
+        # into RNA for each index in the compare below
+        current_rot = current_light_rotation[:]
+        # as_pointer() is a plain int: cheaper to hash than name_full
+        # and unaffected by renames. Only valid until the file is reloaded.
+        light_obj_key = light_obj.as_pointer()
+
+        prev_rot = _previous_light_rotations.get(light_obj_key, _NO_PREVIOUS_ROTATION)
+        # Squared distance against a squared threshold (1e-5 ** 2).
+        # Keep this as plain float math: no mathutils.Vector construction
+        # (or sqrt) belongs in this per-rig, per-tick loop.
+        dx = prev_rot[0] - current_rot[0]
+        dy = prev_rot[1] - current_rot[1]
+        dz = prev_rot[2] - current_rot[2]
+        if dx * dx + dy * dy + dz * dz < 1e-10:
+            continue
+
+        # Write the channels directly rather than matrix_basis: decomposing
+        # a matrix would re-express the euler and fold negative scale
+        # into the rotation
+        position, rotation, scale = math_helpers.calculateWeightedEmptyPosition(
+            math_helpers.getPackedCorrelations(rig_item), current_light_rotation
         )
-        empty_obj.location = weighted_pos
-        empty_obj.scale = weighted_scale
-        empty_obj.rotation_euler = weighted_rotation
+        empty_obj.location = position
+        empty_obj.rotation_euler = rotation
+        empty_obj.scale = scale
+
+        _previous_light_rotations[light_obj_key] = current_rot
 
-        _previous_light_rotations[light_obj_key] = current_light_rotation.copy()
+    _last_snapshot = snapshot
 
 
 # ---------------------- Register and unregister classes --------------------- #
-CLASSES = [
+CLASSES = (
     SR_CorrelationItem,
     SR_RigItem,
     SR_UL_RigList,
@@ -628,12 +805,13 @@ CLASSES = [
     addremove_helpers.SR_OT_Correlation_Remove,
     addremove_helpers.SR_OT_RigList_Remove,
     SR_PT_ShadingRigPanel,
-]
+)
+
+_register_classes, _unregister_classes = bpy.utils.register_classes_factory(CLASSES)
 
 
 def register():
-    for cls in CLASSES:
-        bpy.utils.register_class(cls)
+    _register_classes()
 
     bpy.types.Scene.shading_rig_list = CollectionProperty(
         type=SR_RigItem,
@@ -654,7 +832,7 @@ def register():
         name="Default Light",
         description="The default light assigned to new rigs",
         type=bpy.types.Object,
-        poll=lambda self, obj: obj.type == "LIGHT",
+        poll=_poll_light,
     )
     bpy.types.Scene.shading_rig_show_defaults = BoolProperty(
         name="Show Defaults",
@@ -671,7 +849,15 @@ def register():
 
     bpy.app.handlers.depsgraph_update_post.append(update_shading_rig_handler)
 
+    # Must run before load_handler, which may add drivers that call the namespace entry
+    bpy.app.handlers.load_post.append(driver_namespace_load_handler)
     bpy.app.handlers.load_post.append(load_handler)
+    bpy.app.handlers.load_post.append(clear_rotation_cache_handler)
+    bpy.app.handlers.load_post.append(msgbus_load_handler)
+    bpy.app.handlers.save_pre.append(save_handler)
+    bpy.app.handlers.undo_post.append(undo_handler)
+    bpy.app.handlers.redo_post.append(undo_handler)
+    subscribe_to_renames()
 
     bpy.types.Scene.shading_rig_corr_readonly = BoolProperty(
         name="Read-Only Correlations",
@@ -679,10 +865,18 @@ def register():
         default=True,
     )
 
+    # New effects call the packer once per channel from the scene's drivers
+    # (see update_helpers.add_packing_drivers), through the namespace entry.
+    # Drivers from older files call bpy.packing_algorithm and are left as
+    # they are, so those files keep working with earlier versions of the addon.
+    register_driver_namespace()
     bpy.packing_algorithm = hansens_float_packer.packing_algorithm
 
 
 def unregister():
+    # Before anything is torn down: the sync reads the scene properties below
+    json_helpers.flush_scheduled_sync()
+
     del bpy.types.Scene.shading_rig_default_material
     del bpy.types.Scene.shading_rig_default_light
 
@@ -693,11 +887,32 @@ def unregister():
     if update_shading_rig_handler in bpy.app.handlers.depsgraph_update_post:
         bpy.app.handlers.depsgraph_update_post.remove(update_shading_rig_handler)
 
+    if driver_namespace_load_handler in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(driver_namespace_load_handler)
+
     if load_handler in bpy.app.handlers.load_post:
         bpy.app.handlers.load_post.remove(load_handler)
 
+    if clear_rotation_cache_handler in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(clear_rotation_cache_handler)
+
+    if msgbus_load_handler in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(msgbus_load_handler)
+
+    if save_handler in bpy.app.handlers.save_pre:
+        bpy.app.handlers.save_pre.remove(save_handler)
+
+    if undo_handler in bpy.app.handlers.undo_post:
+        bpy.app.handlers.undo_post.remove(undo_handler)
+
+    if undo_handler in bpy.app.handlers.redo_post:
+        bpy.app.handlers.redo_post.remove(undo_handler)
+
+    bpy.msgbus.clear_by_owner(_msgbus_owner)
+
     del bpy.types.Scene.shading_rig_show_defaults
     del bpy.types.Scene.shading_rig_corr_readonly
 
-    for cls in reversed(CLASSES):
-        bpy.utils.unregister_class(cls)
+    bpy.app.driver_namespace.pop("packing_algorithm", None)
+
+    _unregister_classes()
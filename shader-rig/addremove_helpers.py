@@ -3,7 +3,20 @@ from bpy.types import (
     Operator,
 )
 
-from . import json_helpers
+from . import json_helpers, update_helpers
+
+# Effect drivers read from the active scene's shading_rig_list
+_DRIVER_CONTEXT = "ACTIVE_SCENE"
+
+# Initial packed value. ID properties copy on assignment, so one shared
+# (immutable) constant serves every object
+_ZERO3 = (0, 0, 0)
+
+
+def _make_channel_paths(rig_index):
+    """Driver data paths to each channel of a rig's packed values."""
+    prefix = "shading_rig_list[%d].packed" % rig_index
+    return tuple("%s[%d]" % (prefix, channel) for channel in range(3))
 
 
 class SR_OT_RigList_Add(Operator):
@@ -12,6 +25,7 @@ class SR_OT_RigList_Add(Operator):
     bl_idname = "shading_rig.list_add"
     bl_label = "Add Effect"
     bl_description = "Create a new Empty as a new effect"
+    bl_options = {"REGISTER", "UNDO"}
 
     @classmethod
     def poll(cls, context):
@@ -31,6 +45,10 @@ class SR_OT_RigList_Add(Operator):
         rig_list = scene.shading_rig_list
 
         new_item = rig_list.add()
+        # Each len() on an RNA collection crosses into C; the list
+        # doesn't change size again in here, so read it once
+        rig_count = len(rig_list)
+        new_index = rig_count - 1
 
         if scene.shading_rig_default_material:
             new_item.material = scene.shading_rig_default_material
@@ -38,80 +56,84 @@ class SR_OT_RigList_Add(Operator):
         if scene.shading_rig_default_light:
             new_item.light_object = scene.shading_rig_default_light
 
-        bpy.ops.object.empty_add(type="SPHERE", location=cursor_location)
-        new_empty = context.active_object
+        # Create the empty through the data API rather than empty_add,
+        # which would resolve operator context, push an undo step and
+        # force a depsgraph evaluation just to hand back the active object.
+        # Everything is set before the empty is linked into the scene.
+        new_empty = bpy.data.objects.new("SR_Empty", None)
+        new_empty.empty_display_type = "SPHERE"
         new_empty.empty_display_size = 0.15
         new_empty.show_name = True
         new_empty.show_in_front = True
+        new_empty.location = cursor_location
+        context.collection.objects.link(new_empty)
+
+        # Match empty_add: the new empty becomes the only selected, active object
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        new_empty.select_set(True)
+        context.view_layer.objects.active = new_empty
 
         new_item.empty_object = new_empty
 
-        new_item.name = (
-            f"SR_Effect_{scene.shading_rig_chararacter_name}_{len(rig_list):03d}"
-        )
+        effect_name = f"SR_Effect_{scene.shading_rig_chararacter_name}_{rig_count:03d}"
+        new_item.name = effect_name
 
-        new_item.last_empty_name = new_item.name
+        new_item.last_empty_name = effect_name
 
-        json_helpers.set_shading_rig_list_index(len(rig_list) - 1)
+        json_helpers.set_shading_rig_list_index(new_index)
 
-        objects_with_material = []
-        for obj in bpy.data.objects:
-            if any(s.material == new_item.material for s in obj.material_slots):
-                objects_with_material.append(obj)
+        # Slots are named after their material, so a name lookup on the
+        # slot collection replaces comparing every slot from Python
+        material_name = new_item.material.name
+        objects_with_material = [
+            obj for obj in bpy.data.objects if material_name in obj.material_slots
+        ]
 
         print(
-            f"Objects with material '{new_item.material.name}': {len(objects_with_material)} found."
+            f"Objects with material '{material_name}': {len(objects_with_material)} found."
         )
 
-        rig_index = len(rig_list) - 1
+        rig_index = new_index
+
+        # The packer runs once for the effect (in the scene's drivers)
+        # and each object's drivers just copy the result, so they need no Python
+        update_helpers.add_packing_drivers(scene, rig_index)
+        channel_paths = _make_channel_paths(rig_index)
+
+        # Same property on every object; the drivers fill in the values
+        packed_prop_name = f"packed:{effect_name}"
+        data_path = f'["{packed_prop_name}"]'
 
         for obj in objects_with_material:
-            packed_prop_name = f"packed:{new_item.name}"
-            obj[packed_prop_name] = [0, 0, 0]
+            obj[packed_prop_name] = _ZERO3
+
+            # Create the animation data once and add the fcurves directly,
+            # rather than having driver_add resolve the path and animation
+            # data again for every channel
+            drivers = obj.animation_data_create().drivers
 
             # Create drivers for each channel (0=red, 1=green, 2=blue)
             for channel in range(3):
-                fcurve = obj.driver_add(f'["{packed_prop_name}"]', channel)
-                driver = fcurve.driver
-                driver.type = "SCRIPTED"
-
-                # Create input variables as Context Properties
-                var_names = [
-                    "elongation",
-                    "sharpness",
-                    "bulge",
-                    "bend",
-                    "hardness",
-                    "mode",
-                    "clamp",
-                    "rotation"
-                ]
-                var_paths = [
-                    f"shading_rig_list[{rig_index}].elongation",
-                    f"shading_rig_list[{rig_index}].sharpness",
-                    f"shading_rig_list[{rig_index}].bulge",
-                    f"shading_rig_list[{rig_index}].bend",
-                    f"shading_rig_list[{rig_index}].hardness",
-                    f"shading_rig_list[{rig_index}].mode",
-                    f"shading_rig_list[{rig_index}].clamp",
-                    f"shading_rig_list[{rig_index}].rotation",
-                ]
-
-                # Create driver variables
-                for var_name, var_path in zip(var_names, var_paths):
-                    var = driver.variables.new()
-                    var.name = var_name
-                    var.type = "CONTEXT_PROP"
-                    var.targets[0].context_property = "ACTIVE_SCENE"
-                    var.targets[0].data_path = var_path
-
-                # Set the expression to use the input variables
-                driver.expression = (
-                    f"bpy.packing_algorithm("
-                    f"elongation, sharpness, bulge, bend, hardness, mode, clamp, rotation)[{channel}]"
-                )
-
-        json_helpers.sync_scene_to_json(context.scene)
+                # Re-adding an effect with the same name (or redoing the
+                # operator) would otherwise stack variables on the old driver
+                if drivers.find(data_path, index=channel):
+                    continue
+
+                driver = drivers.new(data_path, index=channel).driver
+                # A single-variable AVERAGE is evaluated natively,
+                # unlike a SCRIPTED expression
+                driver.type = "AVERAGE"
+
+                var = driver.variables.new()
+                var.name = "packed"
+                var.type = "CONTEXT_PROP"
+                target = var.targets[0]
+                target.context_property = _DRIVER_CONTEXT
+                target.data_path = channel_paths[channel]
+
+        update_helpers.mark_active_rigs_dirty()
+        json_helpers.schedule_sync(context.scene)
 
         return {"FINISHED"}
 
@@ -122,26 +144,30 @@ class SR_OT_Correlation_Add(Operator):
     bl_idname = "shading_rig.correlation_add"
     bl_label = "Add Correlation"
     bl_description = "Add a new correlation to the active rig"
+    bl_options = {"REGISTER", "UNDO"}
 
     @classmethod
     def poll(cls, context):
         scene = context.scene
-        if not (
-            json_helpers.get_shading_rig_list_index() >= 0
-            and len(scene.shading_rig_list) > 0
-        ):
+        rig_list = scene.shading_rig_list
+        # Cheap RNA length check first: an empty list (the usual state at
+        # startup) then never reaches the scene properties lookup
+        if len(rig_list) == 0:
             cls.poll_message_set("No effects in the list.")
             return False
 
-        if not scene.shading_rig_list[
-            json_helpers.get_shading_rig_list_index()
-        ].light_object:
+        index = json_helpers.get_shading_rig_list_index()
+        if not 0 <= index < len(rig_list):
+            cls.poll_message_set("No effects in the list.")
+            return False
+
+        active_rig_item = rig_list[index]
+
+        if not active_rig_item.light_object:
             cls.poll_message_set("Active effect has no Light Object assigned.")
             return False
 
-        if not scene.shading_rig_list[
-            json_helpers.get_shading_rig_list_index()
-        ].empty_object:
+        if not active_rig_item.empty_object:
             cls.poll_message_set("Active effect has no Empty Object assigned.")
             return False
 
@@ -149,9 +175,7 @@ class SR_OT_Correlation_Add(Operator):
             cls.poll_message_set("Please set a character name.")
             return False
 
-        if not scene.shading_rig_list[
-            json_helpers.get_shading_rig_list_index()
-        ].added_to_material:
+        if not active_rig_item.added_to_material:
             cls.poll_message_set("Add the effect to a material first.")
             return False
 
@@ -160,9 +184,8 @@ class SR_OT_Correlation_Add(Operator):
     def execute(self, context):
         try:
             scene = context.scene
-            active_rig_item = scene.shading_rig_list[
-                json_helpers.get_shading_rig_list_index()
-            ]
+            index = json_helpers.get_shading_rig_list_index()
+            active_rig_item = scene.shading_rig_list[index]
 
             light_obj = active_rig_item.light_object
             empty_obj = active_rig_item.empty_object
@@ -173,15 +196,17 @@ class SR_OT_Correlation_Add(Operator):
                 )
                 return {"CANCELLED"}
 
-            new_corr = active_rig_item.correlations.add()
-            new_corr.name = f"Correlation_{scene.shading_rig_chararacter_name}_{len(active_rig_item.correlations):03d}"
+            correlations = active_rig_item.correlations
+            new_corr = correlations.add()
+            corr_count = len(correlations)
+            new_corr.name = f"Correlation_{scene.shading_rig_chararacter_name}_{corr_count:03d}"
 
             new_corr.light_rotation = light_obj.rotation_euler
             new_corr.empty_position = empty_obj.location
             new_corr.empty_scale = empty_obj.scale
             new_corr.empty_rotation = empty_obj.rotation_euler
 
-            active_rig_item.correlations_index = len(active_rig_item.correlations) - 1
+            active_rig_item.correlations_index = corr_count - 1
 
             self.report({"INFO"}, f"Stored pose in '{new_corr.name}'.")
 
@@ -189,7 +214,8 @@ class SR_OT_Correlation_Add(Operator):
             self.report({"ERROR"}, "Failed to add correlation. " + str(e))
             return {"CANCELLED"}
 
-        json_helpers.sync_scene_to_json(context.scene)
+        update_helpers.mark_active_rigs_dirty()
+        json_helpers.schedule_sync(context.scene)
         return {"FINISHED"}
 
 
@@ -199,34 +225,34 @@ class SR_OT_Correlation_Remove(Operator):
     bl_idname = "shading_rig.correlation_remove"
     bl_label = "Remove Correlation"
     bl_description = "Remove the selected correlation from the active effect"
+    bl_options = {"REGISTER", "UNDO"}
 
     @classmethod
     def poll(cls, context):
-        scene = context.scene
+        rig_list = context.scene.shading_rig_list
+        if len(rig_list) == 0:
+            cls.poll_message_set("No effects in the list.")
+            return False
 
-        if not (
-            json_helpers.get_shading_rig_list_index() >= 0
-            and len(scene.shading_rig_list) > 0
-        ):
+        index = json_helpers.get_shading_rig_list_index()
+        if not 0 <= index < len(rig_list):
             cls.poll_message_set("No effects in the list.")
             return False
-        active_rig_item = scene.shading_rig_list[
-            json_helpers.get_shading_rig_list_index()
-        ]
-        return len(active_rig_item.correlations) > 0
+        return len(rig_list[index].correlations) > 0
 
     def execute(self, context):
         scene = context.scene
         active_rig_item = scene.shading_rig_list[
             json_helpers.get_shading_rig_list_index()
         ]
+        correlations = active_rig_item.correlations
         index = active_rig_item.correlations_index
 
-        if index >= len(active_rig_item.correlations):
+        if index >= len(correlations):
             return {"CANCELLED"}
 
-        removed_name = active_rig_item.correlations[index].name
-        active_rig_item.correlations.remove(index)
+        removed_name = correlations[index].name
+        correlations.remove(index)
 
         if index > 0:
             active_rig_item.correlations_index = index - 1
@@ -234,7 +260,8 @@ class SR_OT_Correlation_Remove(Operator):
             active_rig_item.correlations_index = 0
 
         self.report({"INFO"}, f"Removed correlation '{removed_name}' from effect.")
-        json_helpers.sync_scene_to_json(context.scene)
+        update_helpers.mark_active_rigs_dirty()
+        json_helpers.schedule_sync(context.scene)
         return {"FINISHED"}
 
 
@@ -246,6 +273,7 @@ class SR_OT_RigList_Remove(Operator):
     bl_description = (
         "Remove the selected effect and its associated objects from the scene"
     )
+    bl_options = {"REGISTER", "UNDO"}
 
     @classmethod
     def poll(cls, context):
@@ -268,19 +296,26 @@ class SR_OT_RigList_Remove(Operator):
             objects_to_delete.append(item_to_remove.empty_object)
 
         rig_list.remove(index)
+        # The packing drivers are per index and every later effect just moved
+        # down one, so it's the drivers on the old last index that are left over
+        update_helpers.remove_packing_drivers(scene, len(rig_list))
 
         if index > 0:
             json_helpers.set_shading_rig_list_index(index - 1)
         else:
             json_helpers.set_shading_rig_list_index(0)
 
-        if objects_to_delete:
-            bpy.ops.object.select_all(action="DESELECT")
-            for obj in objects_to_delete:
-                if obj.name in bpy.data.objects:
-                    bpy.data.objects[obj.name].select_set(True)
-            bpy.ops.object.delete()
-
-        json_helpers.sync_scene_to_json(context.scene)
+        # Remove the data directly instead of going through
+        # select_all + object.delete, which need operator context
+        # and walk every object in the scene
+        for obj in objects_to_delete:
+            try:
+                bpy.data.objects.remove(obj, do_unlink=True)
+            except ReferenceError:
+                # Already deleted
+                pass
+
+        update_helpers.mark_active_rigs_dirty()
+        json_helpers.schedule_sync(context.scene)
 
         return {"FINISHED"}
@@ -10,8 +10,8 @@ import bpy
 # This is incredibly stupid but ¯\_(ツ)_/¯
 
 
-def serialize_rig_list_to_json(rig_list):
-    """Convert rig list to JSON string."""
+def snapshot_rig_list(rig_list):
+    """Read the rig list out of RNA into plain Python data."""
     data = []
     for rig in rig_list:
         empty_object_name = ""
@@ -50,7 +50,14 @@ def serialize_rig_list_to_json(rig_list):
             ],
         }
         data.append(rig_data)
-    return json.dumps(data)
+    return data
+
+
+def serialize_rig_list_to_json(rig_list):
+    """Convert rig list to JSON string."""
+    # Compact separators: this string is rewritten on every sync and
+    # stored in the .blend, and nobody reads it by eye
+    return json.dumps(snapshot_rig_list(rig_list), separators=(",", ":"))
 
 
 def deserialize_rig_list_from_json(json_string):
@@ -72,6 +79,32 @@ def sync_scene_to_json(scene):
     set_shading_rig_list_json(json_data)
 
 
+# Bursts of edits (dragging a slider, clicking add/remove a few times)
+# would otherwise re-serialize the whole rig list on every single change.
+_SYNC_DELAY = 0.5
+
+
+def schedule_sync(scene):
+    """Debounced sync_scene_to_json; repeated calls within the delay write once."""
+    # The scene is read when the timer fires rather than kept here, so no
+    # reference outlives an undo step. The timer isn't persistent: a file
+    # load drops it along with the file whose edits it would have synced.
+    if not bpy.app.timers.is_registered(_scheduled_sync_timer):
+        bpy.app.timers.register(_scheduled_sync_timer, first_interval=_SYNC_DELAY)
+
+
+def flush_scheduled_sync():
+    """Run a pending scheduled sync now (e.g. before saving)."""
+    if bpy.app.timers.is_registered(_scheduled_sync_timer):
+        bpy.app.timers.unregister(_scheduled_sync_timer)
+        sync_scene_to_json(bpy.context.scene)
+
+
+def _scheduled_sync_timer():
+    sync_scene_to_json(bpy.context.scene)
+    return None
+
+
 def sync_json_to_scene(scene):
     """Load rig list from JSON into scene collection."""
     json_data = get_shading_rig_list_json()
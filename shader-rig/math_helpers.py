@@ -1,23 +1,91 @@
-from mathutils import Euler, Vector
+# numpy is imported inside the functions that need it, so enabling the
+# addon doesn't pay for importing it until a rig is actually evaluated.
+# The per-rig helpers take it as an argument from calculateWeightedEmptyPosition
+# instead of importing it again on every call.
+
+# ---------------------------- Correlation packing --------------------------- #
+
+# Correlation fields packed into one contiguous (n, 12) array per rig:
+# light rotation, empty position, empty rotation, empty scale (3 floats each).
+# The CollectionProperty stays the source of truth for the UI and JSON;
+# this is just a cache keyed by the rig item's pointer.
+_CORRELATION_FIELDS = ("light_rotation", "empty_position", "empty_rotation", "empty_scale")
+_packed_correlations = {}
+
+
+def clearPackedCorrelations(self=None, context=None):
+    """
+    Update callback (and plain function) that drops all packed correlation data.
+    Call whenever correlations are added, removed, edited or reloaded.
+    """
+    _packed_correlations.clear()
+
+
+def getPackedCorrelations(rig_item):
+    """
+    Return the rig's correlations as an (n, 12) array, packing them on first use.
+    foreach_get does each field in a single call instead of one RNA access per item.
+    """
+    key = rig_item.as_pointer()
+    packed = _packed_correlations.get(key)
+    if packed is None:
+        import numpy as np
+
+        correlations = rig_item.correlations
+        n = len(correlations)
+        packed = np.empty((n, 12), dtype=np.float64)
+        buf = np.empty(n * 3, dtype=np.float32)
+        for i, attr in enumerate(_CORRELATION_FIELDS):
+            correlations.foreach_get(attr, buf)
+            packed[:, i * 3 : i * 3 + 3] = buf.reshape(-1, 3)
+        _packed_correlations[key] = packed
+    return packed
+
 
 # ----------------------- Weight calculation functions ----------------------- #
 
 
-def getDistances(correlations, currentLightRotation):
+def eulersToQuaternions(eulers, np):
+    """
+    Convert an (n, 3) array of XYZ eulers to an (n, 4) array of
+    (w, x, y, z) quaternions, matching mathutils' Euler.to_quaternion().
+    np is the numpy module, passed in by the caller (see calculateWeightedEmptyPosition).
+    """
+    half = eulers * 0.5
+    c = np.cos(half)
+    s = np.sin(half)
+    ci, cj, ch = c[:, 0], c[:, 1], c[:, 2]
+    si, sj, sh = s[:, 0], s[:, 1], s[:, 2]
+
+    cc = ci * ch
+    cs = ci * sh
+    sc = si * ch
+    ss = si * sh
+
+    return np.stack(
+        (
+            cj * cc + sj * ss,
+            cj * sc - sj * cs,
+            cj * ss + sj * cc,
+            cj * cs - sj * sc,
+        ),
+        axis=1,
+    )
+
+
+def getDistances(light_rotations, currentLightRotation, np):
     """
     Prerequisite for calculating weights;
     Finds the angular distance between the current light rotation
     and each of the stored light rotations using quaternions for accuracy.
     """
-    distances = []
-    current_quat = currentLightRotation.to_quaternion()
+    current_quat = np.asarray(currentLightRotation.to_quaternion(), dtype=np.float64)
+    corr_quats = eulersToQuaternions(light_rotations, np)
 
-    for corr in correlations:
-        corr_euler = Euler(corr.light_rotation, "XYZ")
-        corr_quat = corr_euler.to_quaternion()
-        dist = current_quat.rotation_difference(corr_quat).angle
-        distances.append(dist)
-    return distances
+    # The angle of the rotation between two unit quaternions is
+    # 2 * acos(|q1 . q2|), which is always the shortest arc
+    dots = np.abs(corr_quats @ current_quat)
+    return 2.0 * np.arccos(np.clip(dots, 0.0, 1.0))
 
 
 def getWeights(distances):
@@ -26,46 +94,28 @@ def getWeights(distances):
     A smaller distance results in a larger weight.
     All weights are positive and sum to 1.0.
     """
-    if not distances:
-        return []
-
-    weights = []
-    total_weight = 0.0
     epsilon = 1e-6
+    weights = 1.0 / (distances + epsilon)
+    return weights / weights.sum()
 
-    for d in distances:
-        weight = 1.0 / (d + epsilon)
-        weights.append(weight)
-        total_weight += weight
-
-    if total_weight > 0:
-        for i in range(len(weights)):
-            weights[i] /= total_weight
 
-    return weights
-
-
-def calculateWeightedEmptyPosition(correlations, currentLightRotation):
+def calculateWeightedEmptyPosition(packed_correlations, currentLightRotation):
     """
-    Given a list of light rotations -> empty positions and a current light
-    rotation, interpolates the empty position.
+    Given packed light rotations -> empty transforms (see getPackedCorrelations)
+    and a current light rotation, interpolates the empty position.
+    Returns (position, rotation, scale) lists for the caller to write to the
+    Empty's location, rotation_euler and scale channels.
     """
-    if not correlations:
-        return [0.0, 0.0, 0.0], [1.0, 1.0, 1.0]
-    if len(correlations) == 1:
-        return list(correlations[0].empty_position), list(correlations[0].empty_scale)
+    if len(packed_correlations) == 0:
+        return [0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [1.0, 1.0, 1.0]
 
-    distances = getDistances(correlations, currentLightRotation)
-    weights = getWeights(distances)
+    # Once per rig evaluation; the helpers below take the module from here
+    import numpy as np
 
-    weighted_position = Vector((0.0, 0.0, 0.0))
-    weighted_scale = Vector((0.0, 0.0, 0.0))
-    weighted_rotation = Vector((0.0, 0.0, 0.0))
+    distances = getDistances(packed_correlations[:, 0:3], currentLightRotation, np)
+    weights = getWeights(distances)
 
-    for i, corr in enumerate(correlations):
-        weight = weights[i]
-        weighted_position += Vector(corr.empty_position) * weight
-        weighted_scale += Vector(corr.empty_scale) * weight
-        weighted_rotation += Vector(corr.empty_rotation) * weight
+    # (n,) @ (n, 9) -> position, rotation and scale in one go
+    weighted = weights @ packed_correlations[:, 3:12]
 
-    return list(weighted_position), list(weighted_scale), list(weighted_rotation)
+    return weighted[0:3].tolist(), weighted[3:6].tolist(), weighted[6:9].tolist()
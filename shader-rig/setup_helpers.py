@@ -25,14 +25,15 @@ class SR_OT_AddEffectCoordinatesNode(Operator):
 
     @classmethod
     def poll(cls, context):
-        scene = context.scene
-        if not (
-            json_helpers.get_shading_rig_list_index() >= 0
-            and len(scene.shading_rig_list) > 0
-        ):
+        rig_list = context.scene.shading_rig_list
+        if len(rig_list) == 0:
+            return False
+
+        index = json_helpers.get_shading_rig_list_index()
+        if not 0 <= index < len(rig_list):
             return False
 
-        active_item = scene.shading_rig_list[json_helpers.get_shading_rig_list_index()]
+        active_item = rig_list[index]
 
         if not (
             active_item.material
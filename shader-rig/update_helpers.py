@@ -1,12 +1,124 @@
-from . import json_helpers
+from . import json_helpers, math_helpers
 import bpy
 
+# Indices into scene.shading_rig_list of rigs that have an Empty, a Light
+# and at least one correlation, i.e. the only ones the depsgraph handler
+# needs to look at. Rebuilt lazily whenever something marks it dirty.
+_active_rig_cache = []
+_active_rig_cache_key = None
+_active_rig_cache_dirty = True
+
+
+def mark_active_rigs_dirty(self=None, context=None):
+    """
+    Update callback (and plain function) that invalidates the active rig cache.
+    Call whenever rigs or their correlations are added, removed or reassigned.
+    """
+    global _active_rig_cache_dirty
+    _active_rig_cache_dirty = True
+
+
+def update_node_names(rig_item):
+    """Store the shader node names derived from the rig's Empty, so they aren't rebuilt per check."""
+    empty_name = rig_item.empty_object.name if rig_item.empty_object else ""
+    rig_item.shading_node_name = f"ShadingRigEffect_{empty_name}"
+    rig_item.mix_node_name = f"MixRGB_{empty_name}"
+
+
+def get_active_rig_indices(rig_list):
+    """Return the cached indices of rigs the depsgraph handler should process."""
+    global _active_rig_cache, _active_rig_cache_key, _active_rig_cache_dirty
+
+    # Undo and file loads can change the list without going through
+    # our operators, and switching scenes swaps in a different list
+    # entirely, so key the cache by the owning scene as well as the length
+    cache_key = (rig_list.id_data.as_pointer(), len(rig_list))
+    if _active_rig_cache_dirty or _active_rig_cache_key != cache_key:
+        _active_rig_cache = [
+            i
+            for i, rig_item in enumerate(rig_list)
+            if rig_item.empty_object
+            and rig_item.light_object
+            and len(rig_item.correlations) > 0
+        ]
+        _active_rig_cache_key = cache_key
+        _active_rig_cache_dirty = False
+        # Whatever invalidated the rig list may have moved or changed
+        # correlations too, and the packed data is keyed by pointer
+        math_helpers.clearPackedCorrelations()
+
+    return _active_rig_cache
+
+
+# Rig item properties fed into the packing algorithm, in argument order
+_PACKER_ARG_NAMES = (
+    "elongation",
+    "sharpness",
+    "bulge",
+    "bend",
+    "hardness",
+    "mode",
+    "clamp",
+    "rotation",
+)
+_PACKER_CALL = "packing_algorithm(%s)" % ", ".join(_PACKER_ARG_NAMES)
+
+
+def add_packing_drivers(scene, rig_index):
+    """
+    Drive the rig's packed values from its properties with the float packer.
+    These are evaluated with the rest of the scene, so animated effect
+    properties are packed for the frame being evaluated, renders included.
+    The (Python) packer runs three times per effect, not per affected object.
+    """
+    drivers = scene.animation_data_create().drivers
+    packed_path = "shading_rig_list[%d].packed" % rig_index
+    var_paths = [
+        "shading_rig_list[%d].%s" % (rig_index, var_name)
+        for var_name in _PACKER_ARG_NAMES
+    ]
+
+    for channel in range(3):
+        if drivers.find(packed_path, index=channel):
+            continue
+
+        driver = drivers.new(packed_path, index=channel).driver
+        driver.type = "SCRIPTED"
+
+        for var_name, var_path in zip(_PACKER_ARG_NAMES, var_paths):
+            var = driver.variables.new()
+            var.name = var_name
+            var.type = "SINGLE_PROP"
+            target = var.targets[0]
+            # Read this scene's rig, not whichever scene happens to be active
+            target.id_type = "SCENE"
+            target.id = scene
+            target.data_path = var_path
+
+        # The mode enum reads as its item value, which is what the packer expects
+        driver.expression = "%s[%d]" % (_PACKER_CALL, channel)
+
+
+def remove_packing_drivers(scene, rig_index):
+    """Remove the packing drivers for one rig index, if there are any."""
+    anim_data = scene.animation_data
+    if not anim_data:
+        return
+
+    drivers = anim_data.drivers
+    packed_path = "shading_rig_list[%d].packed" % rig_index
+    for channel in range(3):
+        fcurve = drivers.find(packed_path, index=channel)
+        if fcurve:
+            drivers.remove(fcurve)
+
+
 def property_update_sync(self, context):
     """
     Generic update callback for rig item properties.
-    Triggers a sync to the JSON data store.
+    Schedules a sync to the JSON data store.
     """
-    json_helpers.sync_scene_to_json(context.scene)
+    json_helpers.schedule_sync(context.scene)
 
 def update_parent_object(self, context):
     """Create or update a child of constraint on the empty object, to parent_object"""
@@ -15,14 +15,16 @@ class SR_OT_SetEmptyDisplayType(Operator):
 
     @classmethod
     def poll(cls, context):
-        scene = context.scene
-        if not (
-            json_helpers.get_shading_rig_list_index() >= 0
-            and len(scene.shading_rig_list) > 0
-        ):
+        rig_list = context.scene.shading_rig_list
+        if len(rig_list) == 0:
             cls.poll_message_set("No shading rigs in the list.")
             return False
-        active_item = scene.shading_rig_list[json_helpers.get_shading_rig_list_index()]
+
+        index = json_helpers.get_shading_rig_list_index()
+        if not 0 <= index < len(rig_list):
+            cls.poll_message_set("No shading rigs in the list.")
+            return False
+        active_item = rig_list[index]
         return active_item.empty_object is not None
 
     def execute(self, context):